@@ -88,8 +88,8 @@ class LinearRegressionReport:
 
         # take subset of target and deidentified data and convert
         # features to numerical values
-        self.t = to_num(dataset.target_data[available_f].copy())
-        self.s = to_num(dataset.synthetic_data[available_f].copy())
+        self.t = to_num(dataset.target_data[available_f])
+        self.s = to_num(dataset.synthetic_data[available_f])
         # data dictionary
         self.d_dict = dataset.data_dict
         self.r_ui_d = ui_data  # report ui data
@@ -0,0 +1,189 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sdnist.utils
+
+
+def test_discretize_null_value():
+    schema = {
+        "A": {"min": 0, "max": 99, "has_null": True, "null_value": "N"},
+        "B": {"min": 1, "max": 9, "has_null": True, "null_value": -9},
+    }
+    df = pd.DataFrame({"A": ["N", "5", "99"], "B": [-9, 1, 9]})
+
+    df_bin = sdnist.utils.discretize(df, schema, {})
+    assert df_bin["A"].tolist() == [-1, 5, 99]
+    assert df_bin["B"].tolist() == [-1, 0, 8]
+
+    # values that are neither numeric nor null are not silently coded as null
+    with pytest.raises(ValueError):
+        sdnist.utils.discretize(pd.DataFrame({"A": ["N", "5", "x"]}), schema, {})
+    with pytest.raises(ValueError):
+        sdnist.utils.discretize(pd.DataFrame({"A": ["N", "5", ""]}), schema, {})
+    with pytest.raises(ValueError):
+        sdnist.utils.discretize(pd.DataFrame({"A": [1.0, np.nan, 3]}),
+                                {"A": {"min": 0, "max": 9}}, {})
+
+
+def _cut_codes(df, bins_range):
+    bins = sdnist.utils.create_bins(bins_range)
+    return {c: pd.cut(df[c], bins[c], right=False).cat.codes.to_numpy()
+            for c in bins_range}
+
+
+def test_discretize_uniform_bins():
+    bins_range = {
+        "FRAC": {"first_bin_max": 0.5, "last_bin_min": 3.3, "bin_size": 0.1},
+        "PINCP": {"first_bin_max": 0, "last_bin_min": 300000, "bin_size": 20000},
+        "AGEP": {"first_bin_max": 0, "last_bin_min": 90, "bin_size": 3},
+    }
+    rng = np.random.default_rng(0)
+    bins = sdnist.utils.create_bins(bins_range)
+    df = pd.DataFrame({c: rng.uniform(bins[c][1] - 10 * br["bin_size"],
+                                      bins[c][-2] + 10 * br["bin_size"], 2000)
+                       for c, br in bins_range.items()})
+    # values on and one ulp around every bin edge
+    for c in bins_range:
+        edges = bins[c][1:-1]
+        boundary = np.r_[edges, np.nextafter(edges, -np.inf), np.nextafter(edges, np.inf)]
+        df.loc[:len(boundary) - 1, c] = boundary
+
+    df_bin = sdnist.utils.discretize(df, {}, bins_range)
+    for c, codes in _cut_codes(df, bins_range).items():
+        np.testing.assert_array_equal(df_bin[c].to_numpy(), codes)
+
+
+def test_discretize_mixed_columns():
+    bins_range = {
+        "AGEP": {"first_bin_max": 0, "last_bin_min": 90, "bin_size": 3},
+        "POVPIP": {"first_bin_max": 0, "last_bin_min": 501, "bin_size": 50},
+        "FRAC": {"first_bin_max": -1, "last_bin_min": 1, "bin_size": 0.25},
+        "DEPARTS": {"first_bin_max_hour": 5, "last_bin_min_hour": 22,
+                    "bin_size_minutes": 30, "bin_type": "time"},
+    }
+    schema = {"SEX": {"values": [1, 2]}}
+    rng = np.random.default_rng(1)
+    n = 500
+    df = pd.DataFrame({
+        "AGEP": rng.integers(0, 100, n).astype(np.float64),
+        "SEX": rng.integers(1, 3, n),
+        "POVPIP": rng.uniform(-10, 600, n),
+        "DEPARTS": rng.integers(0, 2400, n),
+        "FRAC": rng.uniform(-2, 2, n),
+    })
+    for c in ["AGEP", "POVPIP", "FRAC"]:
+        df.loc[:2, c] = [np.nan, np.inf, -np.inf]
+
+    df_bin = sdnist.utils.discretize(df, schema, bins_range)
+    for c, codes in _cut_codes(df, bins_range).items():
+        np.testing.assert_array_equal(df_bin[c].to_numpy(), codes)
+    assert df_bin["SEX"].tolist() == (df["SEX"] - 1).tolist()
+
+
+def test_simple_logger(capsys):
+    log = sdnist.utils.SimpleLogger()
+    log.msg('Report', level=0, timed=False)
+    log.msg('Root', level=1)
+    log.msg('A', level=2)
+    log.msg('a1', level=3)
+    log.end_msg()
+    log.msg('a2', level=3)
+    log.msg('a3', level=3)  # sibling of 'a2', which is never ended
+    log.end_msg()
+    log.end_msg()
+    log.msg('B', level=2)
+    log.msg('untimed', level=3, timed=False)
+    log.end_msg()
+    log.msg('C')
+    log.end_msg()
+    log.end_msg()
+
+    out = re.sub(r'Time: [0-9.]+s', 'Time: -s', capsys.readouterr().out)
+    assert out.splitlines() == [
+        '| Report',
+        '|-- Root',
+        '|---- A',
+        '|------ >>>> Finished a1 | Time: -s <<<<',
+        '|------ >>>> Finished a3 | Time: -s <<<<',
+        '|---- >>>> Finished A | Time: -s <<<<',
+        '|---- B',
+        '|------ untimed',
+        '|---- >>>> Finished B | Time: -s <<<<',
+        '|-- C',
+        '|-- >>>> Finished C | Time: -s <<<<',
+        '|-- >>>> Finished Root | Time: -s <<<<',
+    ]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "bz2"])
+def test_save_data_frame_arrow(tmp_path, compression):
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y,z", "w"], "c": [1.5, np.nan, 3.0]},
+                      index=[5, 6, 7])
+    p = sdnist.utils.save_data_frame(df, tmp_path, "arrow", use_arrow=True,
+                                     compression=compression)
+    expected = sdnist.utils.save_data_frame(df, tmp_path, "pandas", compression=compression)
+
+    pd.testing.assert_frame_equal(pd.read_csv(p, index_col=0), df)
+    pd.testing.assert_frame_equal(pd.read_csv(p, index_col=0),
+                                  pd.read_csv(expected, index_col=0))
+
+
+def test_read_json(tmp_path):
+    p = tmp_path / "config.json"
+    p.write_text('{"a": NaN, "b": Infinity, "c": 100000000000000000000000}')
+
+    data = sdnist.utils.read_json(p)
+    assert np.isnan(data["a"])
+    assert data["b"] == np.inf
+    assert data["c"] == 10 ** 23
+
+
+def test_create_bins_copies():
+    bins_range = {"AGEP": {"first_bin_max": 0, "last_bin_min": 90, "bin_size": 3}}
+    bins = sdnist.utils.create_bins(bins_range)
+    bins["AGEP"][-1] = bins["AGEP"][-2] + 1
+
+    assert sdnist.utils.create_bins(bins_range)["AGEP"][-1] == np.inf
+
+
+def test_discretize_code_types():
+    bins_range = {
+        "AGEP": {"first_bin_max": 0, "last_bin_min": 90, "bin_size": 3},
+        "WIDE": {"first_bin_max": 0, "last_bin_min": 1000, "bin_size": 1},
+    }
+    schema = {"NOC": {"min": 0, "max": 19}}
+    df = pd.DataFrame({"AGEP": [0, 50, 99], "WIDE": [0, 500, 999], "NOC": [0, 5, 40000]})
+
+    df_bin = sdnist.utils.discretize(df, schema, bins_range)
+    assert df_bin["AGEP"].dtype == np.int8
+    assert df_bin["WIDE"].dtype == np.int16
+    # out of range values are not wrapped
+    assert df_bin["NOC"].tolist() == [0, 5, 40000]
+
+    df_undo = sdnist.utils.undo_discretize(df_bin[["NOC"]], schema, {})
+    assert df_undo["NOC"].dtype == np.int64
+    assert df_undo["NOC"].tolist() == [0, 5, 40000]
+
+    # same code types as `pd.cut` around the int8 boundary
+    for n_categories in [126, 127]:
+        bins_range = {"X": {"first_bin_max": 0, "last_bin_min": n_categories - 1, "bin_size": 1}}
+        df = pd.DataFrame({"X": np.arange(-1, n_categories)})
+        df_bin = sdnist.utils.discretize(df, {}, bins_range)
+        assert df_bin["X"].dtype == _cut_codes(df, bins_range)["X"].dtype
+
+    # codes beyond the int32 range are not wrapped either
+    df_bin = sdnist.utils.discretize(pd.DataFrame({"NOC": [0, 2 ** 40]}), schema, {})
+    assert df_bin["NOC"].dtype == np.int64
+    assert df_bin["NOC"].tolist() == [0, 2 ** 40]
+
+
+def test_discretize_categorical_types():
+    df_int = sdnist.utils.discretize(pd.DataFrame({"A": [1, 2]}), {"A": {"values": [1, 2]}}, {})
+    df_float = sdnist.utils.discretize(pd.DataFrame({"A": [1.0, 2.0]}),
+                                       {"A": {"values": [1.0, 2.0]}}, {})
+    assert df_int["A"].tolist() == df_float["A"].tolist() == [0, 1]
+    assert sdnist.utils._categorical_dtype([1, 2]).categories.dtype == np.int64
+    assert sdnist.utils._categorical_dtype([1.0, 2.0]).categories.dtype == np.float64
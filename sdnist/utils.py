@@ -1,6 +1,10 @@
 from typing import List, Union, Optional
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+from pandas.api.types import is_integer_dtype, is_numeric_dtype
+import functools
 import json
 import os
 import time
@@ -8,8 +12,27 @@ import sys
 
 from pathlib import Path
 
+try:
+    # faster json parser, used by `read_json` when installed
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def create_bins(bins_range: dict):
+    return {f: b.copy() for f, b in _cached_bins(bins_range).items()}
+
+
+def _cached_bins(bins_range: dict) -> dict:
+    # bins only depend on `bins_range`: they are cached under a hashable
+    # copy of it and shared, read-only, by the following calls
+    key = tuple((f, tuple(sorted(br.items()))) for f, br in sorted(bins_range.items()))
+    return _create_bins(key)
+
+
+@functools.lru_cache(maxsize=16)
+def _create_bins(bins_range_items: tuple):
+    bins_range = {f: dict(br) for f, br in bins_range_items}
     bins = dict()
     for f, br in bins_range.items():
         if 'bin_type' not in br:
@@ -21,11 +44,29 @@ def create_bins(bins_range: dict):
             fbm = br['first_bin_max_hour']
             lbm = br['last_bin_min_hour']
             bs = br['bin_size_minutes']
-            bins[f] = np.r_[-np.inf, [h * 100 + m for h in range(fbm, lbm) for m in range(0, 60, bs)],
-                            np.inf]
+            # HHMM times of the bin edges
+            hours = np.arange(fbm, lbm)
+            minutes = np.arange(0, 60, bs)
+            grid = (hours[:, None] * 100 + minutes[None, :]).ravel()
+            bins[f] = np.concatenate(([-np.inf], grid, [np.inf]))
+    for b in bins.values():
+        # cached arrays are shared between callers
+        b.flags.writeable = False
     return bins
 
 
+def _categorical_dtype(values: list) -> pd.CategoricalDtype:
+    # categorical dtypes only depend on the schema values: they are
+    # reused by the following `discretize` calls. Equal values of different
+    # types, e.g. 1, 1.0 and True, hash alike: their type is part of the key
+    return _cached_categorical_dtype(tuple((type(v), v) for v in values))
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_categorical_dtype(typed_values: tuple) -> pd.CategoricalDtype:
+    return pd.CategoricalDtype([v for _, v in typed_values])
+
+
 def discretize(dataset: pd.DataFrame, schema: dict, bins_range: dict, copy: bool = True):
     """ Discretizes `dataset` using `pandas.CategoricalDtypes`. All values are remapped
     from 0 to `n-1` where `n` is the number of distinct values.
@@ -41,62 +82,130 @@ def discretize(dataset: pd.DataFrame, schema: dict, bins_range: dict, copy: bool
     :return: the discretized input `pandas.DataFrame`.
 
     """
-    bins = create_bins(bins_range)
+    bins = _cached_bins(bins_range)
     if copy:
-        dataset = dataset.copy()
+        # columns are only ever replaced, never modified in place:
+        # a shallow copy leaves the original `dataset` untouched
+        dataset = dataset.copy(deep=False)
+    uniform_columns = []
     for column in dataset:
         if column in bins:
             if column in schema and "has_null" in schema[column]:
                 desc = schema[column]
                 null_val = desc['null_value']
-                dataset[column] = pd.to_numeric(dataset[column].replace(null_val, desc["min"] - 1))
-            dataset[column] = pd.cut(dataset[column], bins[column], right=False).cat.codes
+                dataset[column] = _to_numeric(dataset[column].replace(null_val, desc["min"] - 1))
+            if 'bin_type' not in bins_range[column]:
+                # binned below, together with the other uniform width columns
+                uniform_columns.append(column)
+            else:
+                dataset[column] = pd.cut(dataset[column], bins[column], right=False).cat.codes
 
         elif column in schema:
             desc = schema[column]
             if "values" in desc:
-                dataset[column] = dataset[column].astype(pd.CategoricalDtype(desc["values"])).cat.codes
+                dataset[column] = pd.Categorical(dataset[column].to_numpy(),
+                                                 dtype=_categorical_dtype(desc["values"])).codes
             elif "min" in desc.keys():
                 if "has_null" in desc:
-                    null_val = desc['null_value']
-                    dataset[column] = dataset[column].replace(null_val, desc["min"]-1)
-                dataset[column] = pd.to_numeric(dataset[column])
-                dataset[column] = (dataset[column] - desc["min"]).astype(int)
+                    # null values are mapped to `min - 1`, the other values
+                    # are converted to numeric
+                    is_null = dataset[column].eq(desc['null_value']).to_numpy()
+                    arr = np.full(len(dataset), desc["min"] - 1, dtype=np.float64)
+                    arr[~is_null] = _to_numeric(dataset[column][~is_null]).to_numpy(dtype=np.float64)
+                else:
+                    arr = _to_numeric(dataset[column]).to_numpy()
+                codes = arr - desc["min"]
+                if not np.isfinite(codes).all():
+                    raise ValueError(f'Missing or non-finite values in column {column}')
+                # `max` is not enforced here: out of range values of synthetic
+                # datasets fall back to int64 codes instead of wrapping
+                int32 = np.iinfo(np.int32)
+                if codes.size == 0 or (int32.min <= codes.min() and codes.max() <= int32.max):
+                    dataset[column] = codes.astype(np.int32)
+                else:
+                    dataset[column] = codes.astype(np.int64)
             else:
                 #feature unmodified, e.g., 'kind == "ID"' columns
                 pass
         else:
             # Feature is not modified.
             pass
+
+    if uniform_columns:
+        codes = _uniform_bin_codes(dataset[uniform_columns], bins_range, bins)
+        for i, column in enumerate(uniform_columns):
+            dataset[column] = codes[:, i].astype(_codes_dtype(len(bins[column]) - 1))
     return dataset
 
 
-def undo_discretize(dataset, schema, bins, copy: bool = True, handle_inf: bool = True):
-    """ Return an unbinned dataset. """
-    if handle_inf:
-        # In some cases, the bin interval includes infinity
-        # In that case, undoing the discretization is slightly harder
-        original_bins = bins
-        bins = {}
+def _codes_dtype(n_categories: int) -> type:
+    """ Integer type of the codes of `n_categories` categories, as picked by `pd.cut`. """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _to_numeric(column: pd.Series) -> pd.Series:
+    """ `pd.to_numeric`, skipped for columns that already have a numeric dtype. """
+    if is_numeric_dtype(column):
+        return column
+    return pd.to_numeric(column)
+
+
+def _uniform_bin_codes(data: pd.DataFrame, bins_range: dict, bins: dict) -> np.ndarray:
+    """ Returns the `pd.cut(..., right=False)` codes of all the columns of `data`,
+    which must be binned with uniform width bins. The bin index is computed in
+    constant time for all the columns at once instead of searching the bin edges
+    column by column. """
+    x = np.ascontiguousarray(data.apply(_to_numeric).to_numpy(dtype=np.float64))
+    fbm = np.array([bins_range[c]['first_bin_max'] for c in data.columns], dtype=np.float64)
+    bs = np.array([bins_range[c]['bin_size'] for c in data.columns], dtype=np.float64)
+    n_bins = np.array([len(bins[c]) - 1 for c in data.columns])
 
-        for col, bin in original_bins.items():
-            bins[col] = bin.copy()
-            bins[col][-1] = bin[-2] + 1
+    # NaN and +inf fall outside of every bin, as with `pd.cut`
+    valid = x < np.inf
+    codes = np.floor((np.where(valid, x, 0) - fbm) / bs) + 1
+    codes = np.clip(codes, 0, n_bins - 1).astype(np.int64)
 
+    # Rounding puts values next to an edge one bin off: check the codes against
+    # the actual bin edges, padded with +inf to the longest bins.
+    edges = np.full((n_bins.max() + 1, len(data.columns)), np.inf)
+    for i, c in enumerate(data.columns):
+        edges[:n_bins[i] + 1, i] = bins[c]
+    columns = np.arange(len(data.columns))
+    codes -= x < edges[codes, columns]
+    codes += x >= edges[codes + 1, columns]
+
+    codes[~valid] = -1
+    return codes
+
+
+def undo_discretize(dataset, schema, bins, copy: bool = True, handle_inf: bool = True):
+    """ Return an unbinned dataset. """
     if copy:
-        dataset = dataset.copy()
+        # columns are only ever replaced, see `discretize`
+        dataset = dataset.copy(deep=False)
 
     for column in dataset:
         if column in bins:
-            bin = bins[column]
-            dataset[column] = bin[dataset[column].values]
+            edges = np.asarray(bins[column])
+            if handle_inf:
+                # In some cases, the bin interval includes infinity
+                # In that case, undoing the discretization is slightly harder
+                edges = np.concatenate((edges[:-1], [edges[-2] + 1]))
+            dataset[column] = np.take(edges, dataset[column].to_numpy())
 
         elif column in schema:
             desc = schema[column]
             if "values" in desc:
                 dataset[column] = np.array(desc["values"])[dataset[column].values]
             elif "min" in desc:
-                dataset[column] += desc["min"]
+                codes = dataset[column]
+                if is_integer_dtype(codes):
+                    # values are returned as int64 whatever the codes type
+                    codes = codes.astype(np.int64)
+                dataset[column] = codes + desc["min"]
             else:
                 raise ValueError("Unknown column, probably due to invalid schema")
         
@@ -109,6 +218,8 @@ def undo_discretize(dataset, schema, bins, copy: bool = True, handle_inf: bool =
 
 
 def unstack(dataset, user_id: str = "sim_individual_id", time: str = "YEAR", flat: bool = False):
+    # `DataFrame.pivot` goes through the same set_index/unstack steps but has no
+    # `fill_value`: missing years would become NaN and upcast the codes to float.
     df = dataset.set_index([user_id, time]).unstack(time, fill_value=-1)
 
     if flat:
@@ -131,18 +242,57 @@ def stack(dataset, user_id: str = "sim_individual_id", time: str = "YEAR"):
     }, inplace=True)
 
     # Remove empty rows
-    keep = (df != -1).all(axis="columns")
-    return df[keep]
+    arr = df.to_numpy(copy=False)
+    keep = ~(arr == -1).any(axis=1)
+    return df.iloc[keep]
 
 
 def read_json(path: Path):
+    if orjson is not None:
+        data = Path(path).read_bytes()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than json, e.g. for NaN or big integers
+            return json.loads(data)
     with open(path, 'r') as f:
         return json.load(f)
 
 
-def save_data_frame(data: pd.DataFrame, output_dir: Path, filename: str) -> Path:
-    p = Path(output_dir, f'{filename}.csv')
-    data.to_csv(p)
+# file suffix of each compression supported by `save_data_frame`
+_COMPRESSION_SUFFIXES = {'gzip': '.gz', 'bz2': '.bz2'}
+
+
+def save_data_frame(data: pd.DataFrame, output_dir: Path, filename: str,
+                    use_arrow: bool = False, compression: Optional[str] = None,
+                    chunksize: int = 1_000_000) -> Path:
+    """Saves `data` as csv file named `filename` in `output_dir`. With `use_arrow`,
+    the file is written by the multithreaded `pyarrow` csv writer instead of
+    `DataFrame.to_csv`, which is much faster for large data frames. Otherwise
+    rows are written `chunksize` at a time to bound the serialization memory.
+    `compression` is either 'gzip' or 'bz2' and adds the matching suffix
+    to the file name."""
+    suffix = '.csv'
+    if compression is not None:
+        if compression not in _COMPRESSION_SUFFIXES:
+            raise ValueError(f'Unsupported compression: {compression}')
+        suffix += _COMPRESSION_SUFFIXES[compression]
+    p = Path(output_dir, f'{filename}{suffix}')
+    if use_arrow:
+        table = pa.Table.from_pandas(data, preserve_index=True)
+        # move the index columns first and name them as `DataFrame.to_csv` does
+        n_cols = len(data.columns)
+        n_index = data.index.nlevels
+        table = table.select(list(range(n_cols, n_cols + n_index)) + list(range(n_cols)))
+        index_names = ['' if n is None else str(n) for n in data.index.names]
+        table = table.rename_columns(index_names + table.column_names[n_index:])
+        if compression is not None:
+            with pa.CompressedOutputStream(str(p), compression) as out:
+                pcsv.write_csv(table, out)
+        else:
+            pcsv.write_csv(table, str(p))
+    else:
+        data.to_csv(p, chunksize=chunksize, compression=compression)
     return p
 
 
@@ -155,20 +305,13 @@ def relative_path(path: Union[List[Path], Path]) -> Union[List[str], str]:
 
 
 def create_path(path: Path):
-    if not path.exists():
-        os.mkdir(path)
+    os.makedirs(path, exist_ok=True)
 
 
 def to_num(data: pd.DataFrame) -> pd.DataFrame:
     """Converts data to numeric and drops all the records
     with N values"""
-    d = data
-
-    for f in d.columns:
-        d = d[~d[f].isin(['N'])]
-    for f in d.columns:
-        d.loc[:, f] = pd.to_numeric(d.loc[:, f])
-    return d
+    return data.loc[~data.isin(['N']).any(axis=1)].apply(_to_numeric, axis=0)
 
 
 def df_filter(data: pd.DataFrame, filters: Optional[List] = None) -> pd.DataFrame:
@@ -180,21 +323,27 @@ def df_filter(data: pd.DataFrame, filters: Optional[List] = None) -> pd.DataFram
     """
     if not filters:
         return data
+    mask = np.ones(len(data), dtype=bool)
     for d_filter in filters:
         feature = d_filter[0]
         values = d_filter[1]
-        data = data[data[feature].isin(values)]
-    return data
+        mask &= data[feature].isin(values).to_numpy()
+    return data.loc[mask]
 
 
-class SimpleLogger:
-    ptrn = '/*\*/'  # separator pattern
+# SimpleLogger indentation of each message level
+_INDENTS = tuple('|' + '--' * i for i in range(16))
 
+
+def _indent(level: int) -> str:
+    return _INDENTS[min(level, len(_INDENTS) - 1)]
+
+
+class SimpleLogger:
     def __init__(self):
         self.level_messages = dict()
-        self.current_head = None
+        self.stack: List[str] = []  # messages from the root to the current head
         self.current_level = None
-        self.msg_path = dict()
         self.root = None
 
     def msg(self, message: str, level=1, timed=True):
@@ -205,46 +354,24 @@ class SimpleLogger:
 
             t = Time()
             t.start(message)
-            msg_full_path = self.get_msg_path(message, level)
+            if self.current_level == level and len(self.stack) > 1:
+                # sibling of the current head
+                self.stack.pop()
+            self.stack.append(message)
             self.current_level = level
-            self.current_head = msg_full_path
-            self.level_messages[self.current_head] = (message, level, t)
+            self.level_messages[tuple(self.stack)] = (message, level, t)
 
-        if level < 3:
-            level_indent = '|' + ''.join(['--'
-                                          for _ in range(level)])
-
-            sys_print(level_indent + ' ' + message)
-        elif not timed:
-            level_indent = '|' + ''.join(['--'
-                                          for _ in range(level)])
-
-            sys_print(level_indent + ' ' + message)
+        if level < 3 or not timed:
+            sys_print(_indent(level) + ' ' + message)
 
     def end_msg(self):
-        head_data = self.level_messages[self.current_head]
-        message, level, t = head_data
-        del self.level_messages[self.current_head]
-        if self.current_head != self.root:
-            parent_path = self.ptrn.join(self.current_head.split(self.ptrn)[:-1])
-            self.current_head = parent_path
+        message, level, t = self.level_messages.pop(tuple(self.stack))
+        if len(self.stack) > 1:
+            self.stack.pop()
             self.current_level = level - 1
         secs = t.time()
-        level_indent = '|' + ''.join(['--'
-                                      for _ in range(level)])
-        sys_print(level_indent + f' >>>> Finished {message} | Time: {round(secs, 1)}s <<<<')
-
-    def get_msg_path(self, msg, level):
-        if self.current_level == level and self.current_head != self.root:
-            if self.current_head:
-                parent_path = self.ptrn.join(self.current_head.split(self.ptrn)[:-1])
-                msg_path = parent_path + self.ptrn + msg
-                return msg_path
-            else:
-                self.current_head = self.root
-                return self.current_head
-        else:
-            return self.current_head + self.ptrn + msg
+        sys_print(_indent(level) + f' >>>> Finished {message} | Time: {round(secs, 1)}s <<<<')
+        sys.stdout.flush()
 
 
 class Time:
@@ -267,5 +394,5 @@ class Time:
 
 
 def sys_print(data: str):
-    sys.stdout.flush()
-    sys.stdout.write(data + '\n')
+    sys.stdout.write(data)
+    sys.stdout.write('\n')
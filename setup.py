@@ -29,7 +29,7 @@ setup(
         "loguru>=0.6",
         "matplotlib>=3",
         "numpy>=1",
-        "pandas>=1",
+        "pandas>=1.5",
         "pyarrow>=7",
         "requests>=2",
         "scikit-learn>=1",